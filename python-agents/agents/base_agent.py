@@ -1,18 +1,62 @@
 from abc import ABC, abstractmethod
-from typing import Dict, List, Any
+from collections import defaultdict
+from operator import itemgetter
+from typing import Dict, List, Any, ClassVar, Optional
 from langchain_openai import ChatOpenAI
 from langchain.schema import HumanMessage, SystemMessage
+import asyncio
 import os
 
+# Upper bound on in-flight LLM requests across all agents in the process
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+
+_SEM = asyncio.Semaphore(LLM_CONCURRENCY)
+
+_amount = itemgetter("amount")
+
+def bucket_financial_data(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Split financial rows by data_type, then total each type"""
+    # The grouping loop is the only per-row Python work; totals use C-level sum(map(...)).
+    # NumPy masks over the amounts add passes and measured slower even at 20k rows
+    rows_by_type = defaultdict(list)
+    for item in rows:
+        rows_by_type[item.get("data_type")].append(item)
+    
+    totals = {}
+    for data_type, typed_rows in rows_by_type.items():
+        try:
+            totals[data_type] = sum(map(_amount, typed_rows))
+        except KeyError:
+            # Rows that didn't come straight from the table may omit amount
+            totals[data_type] = sum(row.get("amount", 0) for row in typed_rows)
+    return {"rows": dict(rows_by_type), "totals": totals}
+
 class BaseFinancialAgent(ABC):
+    # Shared by every agent so the underlying HTTP connection pool is reused
+    _LLM_SINGLETON: ClassVar[Optional[ChatOpenAI]] = None
+    
     def __init__(self, agent_name: str):
         self.agent_name = agent_name
-        self.llm = ChatOpenAI(
-            model="anthropic/claude-3.5-sonnet",
-            openai_api_key=os.getenv("OPENROUTER_API_KEY"),
-            openai_api_base="https://openrouter.ai/api/v1",
-            temperature=0.1
-        )
+        self.llm = self._get_llm()
+        # Built once so every call sends an identical prefix; cache_control lets Anthropic models
+        # behind OpenRouter reuse the processed system prompt instead of re-reading it per call
+        self._system_message = SystemMessage(content=[{
+            "type": "text",
+            "text": self.get_system_prompt(),
+            "cache_control": {"type": "ephemeral"}
+        }])
+    
+    @staticmethod
+    def _get_llm() -> ChatOpenAI:
+        """Return the process-wide LLM client, creating it on first use"""
+        if BaseFinancialAgent._LLM_SINGLETON is None:
+            BaseFinancialAgent._LLM_SINGLETON = ChatOpenAI(
+                model="anthropic/claude-3.5-sonnet",
+                openai_api_key=os.getenv("OPENROUTER_API_KEY"),
+                openai_api_base="https://openrouter.ai/api/v1",
+                temperature=0.1
+            )
+        return BaseFinancialAgent._LLM_SINGLETON
     
     @abstractmethod
     async def analyze(self, financial_data: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
@@ -24,18 +68,37 @@ class BaseFinancialAgent(ABC):
         """Get the system prompt for this agent"""
         pass
     
-    async def generate_response(self, user_input: str, context: Dict[str, Any]) -> str:
+    async def generate_response(self, user_input: str, context: Dict[str, Any],
+                                formatted_context: Optional[str] = None) -> str:
         """Generate a response to user input with context"""
-        system_prompt = self.get_system_prompt()
-        context_str = self._format_context(context)
+        responses = await self.generate_responses([user_input], context, formatted_context)
+        return responses[0]
+    
+    async def generate_responses(self, prompts: List[str], context: Dict[str, Any],
+                                 formatted_context: Optional[str] = None) -> List[str]:
+        """Generate responses to several prompts concurrently, sharing the same context"""
+        context_message = self._context_message(context, formatted_context)
         
-        messages = [
-            SystemMessage(content=f"{system_prompt}\n\nContext:\n{context_str}"),
-            HumanMessage(content=user_input)
-        ]
+        async def _one(prompt: str) -> str:
+            async with _SEM:
+                response = await self.llm.ainvoke([self._system_message, context_message, HumanMessage(content=prompt)])
+            return response.content
         
-        response = await self.llm.ainvoke(messages)
-        return response.content
+        return list(await asyncio.gather(*[_one(prompt) for prompt in prompts]))
+    
+    def _context_message(self, context: Dict[str, Any], formatted_context: Optional[str] = None) -> SystemMessage:
+        """Build the per-call context message, reusing formatted_context when the caller already has it"""
+        # The static system prompt is built once per agent; only the context is formatted per call
+        if formatted_context is None:
+            formatted_context = self._format_context(context)
+        return SystemMessage(content=f"Context:\n{formatted_context}")
+    
+    def _get_buckets(self, financial_data: Dict[str, Any]) -> Dict[str, Any]:
+        """Use the buckets precomputed by the orchestrator, or build them from the raw rows"""
+        buckets = financial_data.get("buckets")
+        if buckets is None:
+            buckets = bucket_financial_data(financial_data.get("financial_data") or ())
+        return buckets
     
     def _format_context(self, context: Dict[str, Any]) -> str:
         """Format context data for the LLM"""
@@ -55,4 +118,4 @@ class BaseFinancialAgent(ABC):
     def _calculate_priority_score(self, analysis: Dict[str, Any]) -> int:
         """Calculate priority score for insights (1-10, 10 being highest priority)"""
         # Base implementation - can be overridden by specific agents
-        return 5
\ No newline at end of file
+        return 5
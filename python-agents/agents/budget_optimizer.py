@@ -1,6 +1,42 @@
 from typing import Dict, List, Any
+from collections import defaultdict
+from operator import itemgetter
 from .base_agent import BaseFinancialAgent
-import json
+import bisect
+import heapq
+import orjson
+
+# Expense-ratio tiers: <0.70 very low, <0.85 low, <0.95 medium, <1.0 high, >=1.0 critical
+_BUDGET_THRESHOLDS = (0.70, 0.85, 0.95, 1.0)
+_BUDGET_SCORES = (2, 4, 6, 8, 10)
+
+# Canonical spending buckets used by the recommendation heuristics
+_CATEGORY_BUCKETS = {
+    "Housing": "housing", "Rent": "housing", "Mortgage": "housing",
+    "Transportation": "transport", "Car": "transport", "Gas": "transport",
+    "Entertainment": "entertainment", "Subscriptions": "entertainment",
+    "Food": "food", "Dining": "food", "Groceries": "food",
+}
+_BUCKET_NAMES = ("housing", "transport", "entertainment", "food", "other")
+
+# Number of expense categories included in the analysis prompt
+_PROMPT_TOP_CATEGORIES = 8
+
+# Recommendations with no per-call fields
+_TRANSPORTATION_RECOMMENDATION = {
+    "type": "transportation",
+    "title": "Optimize Transportation Costs",
+    "description": "Transportation costs are above recommended 15% of income",
+    "action": "Review car insurance, consider carpooling, public transit, or more fuel-efficient vehicle",
+    "impact": "Potential savings of $100-300/month"
+}
+_EMERGENCY_BUFFER_RECOMMENDATION = {
+    "type": "emergency_buffer",
+    "title": "Create Budget Buffer",
+    "description": "Very tight budget with little room for unexpected expenses",
+    "action": "Identify $200-500/month in expense reductions for emergency buffer",
+    "impact": "Prevent debt accumulation from unexpected expenses"
+}
 
 class BudgetOptimizerAgent(BaseFinancialAgent):
     def __init__(self):
@@ -31,62 +67,66 @@ Always provide specific, actionable recommendations with clear dollar amounts, p
         """Analyze budget and spending patterns"""
         
         # Extract financial information
-        expense_data = [item for item in financial_data.get("financial_data", []) if item.get("data_type") == "expense"]
-        income_data = [item for item in financial_data.get("financial_data", []) if item.get("data_type") == "income"]
+        buckets = self._get_buckets(financial_data)
+        total_income = buckets["totals"].get("income", 0.0)
+        total_expenses = buckets["totals"].get("expense", 0.0)
         
-        total_income = sum(income.get("amount", 0) for income in income_data)
-        total_expenses = sum(expense.get("amount", 0) for expense in expense_data)
+        # Categorize expenses
+        expense_categories = defaultdict(float)
+        for expense in buckets["rows"].get("expense", ()):
+            expense_categories[expense.get("category", "Other")] += expense.get("amount", 0)
+        
+        # Nothing to analyze - skip the LLM round-trip
+        if total_income == 0 and total_expenses == 0:
+            return {
+                "agent_type": "budget_optimizer",
+                "analysis": "No income or expenses on file.",
+                "recommendations": [],
+                "metrics": {
+                    "monthly_income": 0,
+                    "monthly_expenses": 0,
+                    "expense_ratio": 0,
+                    "largest_expense_category": "None"
+                },
+                "priority_score": 1
+            }
         
         monthly_income = total_income / 12
         monthly_expenses = total_expenses / 12
         
-        # Categorize expenses
-        expense_categories = {}
-        for expense in expense_data:
-            category = expense.get("category", "Other")
-            expense_categories[category] = expense_categories.get(category, 0) + expense.get("amount", 0)
+        # Roll categories up into the fixed set of buckets
+        bucket_totals = dict.fromkeys(_BUCKET_NAMES, 0.0)
+        for category, amount in expense_categories.items():
+            bucket_totals[_CATEGORY_BUCKETS.get(category, "other")] += amount
         
-        # Calculate percentages
+        # Largest expense categories as a share of income, serialized compactly for the prompt
+        top_expenses = heapq.nlargest(_PROMPT_TOP_CATEGORIES, expense_categories.items(), key=itemgetter(1))
         expense_percentages = {
-            category: (amount / total_income * 100) if total_income > 0 else 0
-            for category, amount in expense_categories.items()
+            category: round(amount / total_income * 100, 1) if total_income > 0 else 0
+            for category, amount in top_expenses
         }
         
-        # Identify largest expense categories
-        sorted_expenses = sorted(expense_categories.items(), key=lambda x: x[1], reverse=True)
-        
         # Prepare analysis prompt
         analysis_prompt = f"""
-        Analyze this budget and spending patterns, provide optimization recommendations:
+        Analyze this budget and recommend optimizations.
         
         Monthly Income: ${monthly_income:,.2f}
         Monthly Expenses: ${monthly_expenses:,.2f}
         Monthly Surplus/Deficit: ${monthly_income - monthly_expenses:,.2f}
-        
-        Expense Breakdown by Category:
-        {json.dumps(expense_percentages, indent=2)}
-        
-        Top Expense Categories:
-        {json.dumps(sorted_expenses[:5], indent=2)}
+        Top Expense Categories (% of income): {orjson.dumps(expense_percentages, option=orjson.OPT_NON_STR_KEYS).decode()}
         
         Provide:
-        1. Budget analysis using 50/30/20 rule (needs/wants/savings)
-        2. Specific cost reduction opportunities in each category
-        3. Subscription and recurring expense audit recommendations
-        4. Optimization strategies for largest expense categories
-        5. Automated budgeting and tracking recommendations
-        6. Cash flow improvement strategies
-        7. Emergency expense planning
-        
-        Format as structured analysis with specific dollar amounts and action items.
+        1. Budget analysis using the 50/30/20 rule (needs/wants/savings)
+        2. Cost reductions for the largest categories, including subscriptions and recurring expenses
+        3. Cash flow improvement and emergency expense planning
+        
+        Use specific dollar amounts and action items.
         """
         
         response = await self.generate_response(analysis_prompt, context)
         
         # Generate specific recommendations
-        recommendations = await self._generate_recommendations(
-            expense_categories, monthly_income, monthly_expenses
-        )
+        recommendations = self._generate_recommendations(bucket_totals, monthly_income, monthly_expenses)
         
         return {
             "agent_type": "budget_optimizer",
@@ -96,18 +136,18 @@ Always provide specific, actionable recommendations with clear dollar amounts, p
                 "monthly_income": monthly_income,
                 "monthly_expenses": monthly_expenses,
                 "expense_ratio": (monthly_expenses / monthly_income * 100) if monthly_income > 0 else 0,
-                "largest_expense_category": sorted_expenses[0][0] if sorted_expenses else "None"
+                "largest_expense_category": top_expenses[0][0] if top_expenses else "None"
             },
             "priority_score": self._calculate_budget_priority(monthly_income, monthly_expenses)
         }
     
-    async def _generate_recommendations(self, expense_categories: Dict[str, float], 
-                                      monthly_income: float, monthly_expenses: float) -> List[Dict[str, Any]]:
+    def _generate_recommendations(self, bucket_totals: Dict[str, float], 
+                                  monthly_income: float, monthly_expenses: float) -> List[Dict[str, Any]]:
         """Generate specific budget optimization recommendations"""
         recommendations = []
         
         # Housing cost optimization
-        housing_expenses = expense_categories.get("Housing", 0) + expense_categories.get("Rent", 0) + expense_categories.get("Mortgage", 0)
+        housing_expenses = bucket_totals["housing"]
         housing_percentage = (housing_expenses / (monthly_income * 12) * 100) if monthly_income > 0 else 0
         
         if housing_percentage > 30:
@@ -121,18 +161,12 @@ Always provide specific, actionable recommendations with clear dollar amounts, p
             })
         
         # Transportation optimization
-        transportation = expense_categories.get("Transportation", 0) + expense_categories.get("Car", 0) + expense_categories.get("Gas", 0)
+        transportation = bucket_totals["transport"]
         if transportation > monthly_income * 12 * 0.15:  # More than 15% of income
-            recommendations.append({
-                "type": "transportation",
-                "title": "Optimize Transportation Costs",
-                "description": "Transportation costs are above recommended 15% of income",
-                "action": "Review car insurance, consider carpooling, public transit, or more fuel-efficient vehicle",
-                "impact": "Potential savings of $100-300/month"
-            })
+            recommendations.append(_TRANSPORTATION_RECOMMENDATION.copy())
         
         # Subscription audit
-        entertainment = expense_categories.get("Entertainment", 0) + expense_categories.get("Subscriptions", 0)
+        entertainment = bucket_totals["entertainment"]
         if entertainment > 0:
             recommendations.append({
                 "type": "subscription_audit",
@@ -143,7 +177,7 @@ Always provide specific, actionable recommendations with clear dollar amounts, p
             })
         
         # Food and dining optimization
-        food_expenses = expense_categories.get("Food", 0) + expense_categories.get("Dining", 0) + expense_categories.get("Groceries", 0)
+        food_expenses = bucket_totals["food"]
         if food_expenses > monthly_income * 12 * 0.12:  # More than 12% of income
             recommendations.append({
                 "type": "food_optimization",
@@ -155,27 +189,11 @@ Always provide specific, actionable recommendations with clear dollar amounts, p
         
         # Emergency budget buffer
         if monthly_expenses >= monthly_income * 0.95:  # Spending more than 95% of income
-            recommendations.append({
-                "type": "emergency_buffer",
-                "title": "Create Budget Buffer",
-                "description": "Very tight budget with little room for unexpected expenses",
-                "action": "Identify $200-500/month in expense reductions for emergency buffer",
-                "impact": "Prevent debt accumulation from unexpected expenses"
-            })
+            recommendations.append(_EMERGENCY_BUFFER_RECOMMENDATION.copy())
         
         return recommendations
     
     def _calculate_budget_priority(self, monthly_income: float, monthly_expenses: float) -> int:
         """Calculate priority score based on budget situation"""
         expense_ratio = (monthly_expenses / monthly_income) if monthly_income > 0 else 1
-        
-        if expense_ratio >= 1.0:  # Spending more than earning
-            return 10  # Critical
-        elif expense_ratio >= 0.95:  # Very tight budget
-            return 8   # High
-        elif expense_ratio >= 0.85:  # Moderate budget pressure
-            return 6   # Medium
-        elif expense_ratio >= 0.70:  # Reasonable budget
-            return 4   # Low
-        else:  # Lots of room in budget
-            return 2   # Very low
\ No newline at end of file
+        return _BUDGET_SCORES[bisect.bisect_right(_BUDGET_THRESHOLDS, expense_ratio)]
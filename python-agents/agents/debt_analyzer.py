@@ -1,6 +1,20 @@
 from typing import Dict, List, Any
 from .base_agent import BaseFinancialAgent
-import json
+import bisect
+import orjson
+
+# Debt-to-income tiers (exclusive): <=20 low, >20 medium, >30 high, >40 critical; no debt scores 1
+_DEBT_THRESHOLDS = (20, 30, 40)
+_DEBT_SCORES = (4, 6, 8, 10)
+
+# Consolidation advice has no per-call fields
+_CONSOLIDATION_RECOMMENDATION = {
+    "type": "consolidation",
+    "title": "Consider Debt Consolidation",
+    "description": "Multiple debts could benefit from consolidation",
+    "action": "Research personal loans or balance transfer cards with lower rates",
+    "impact": "Simplify payments and potentially reduce interest rates"
+}
 
 class DebtAnalyzerAgent(BaseFinancialAgent):
     def __init__(self):
@@ -30,41 +44,60 @@ Always provide specific, actionable recommendations with clear timelines and exp
         """Analyze debt situation and provide recommendations"""
         
         # Extract debt information
-        debts = [item for item in financial_data.get("financial_data", []) if item.get("data_type") == "debt"]
-        income_data = [item for item in financial_data.get("financial_data", []) if item.get("data_type") == "income"]
+        buckets = self._get_buckets(financial_data)
+        debts = buckets["rows"].get("debt", [])
         
-        total_debt = sum(debt.get("amount", 0) for debt in debts)
-        total_income = sum(income.get("amount", 0) for income in income_data)
+        total_debt = buckets["totals"].get("debt", 0.0)
+        total_income = buckets["totals"].get("income", 0.0)
+        
+        # Nothing to analyze - skip the LLM round-trip
+        if not debts:
+            return {
+                "agent_type": "debt_analyzer",
+                "analysis": "No debts on file.",
+                "recommendations": [],
+                "metrics": {
+                    "total_debt": 0,
+                    "debt_to_income_ratio": 0,
+                    "debt_count": 0
+                },
+                "priority_score": 1
+            }
         
         # Calculate debt-to-income ratio
         debt_to_income = (total_debt / total_income * 100) if total_income > 0 else 0
         
+        # Only the fields the analysis needs, serialized compactly to keep the prompt small
+        debt_rows = [
+            {
+                "category": debt.get("category"),
+                "amount": debt.get("amount"),
+                "interest_rate": (debt.get("metadata") or {}).get("interest_rate")
+            }
+            for debt in debts
+        ]
+        
         # Prepare analysis prompt
         analysis_prompt = f"""
-        Analyze this debt situation and provide comprehensive recommendations:
+        Analyze this debt situation and recommend a payoff plan.
         
         Total Debt: ${total_debt:,.2f}
-        Total Annual Income: ${total_income:,.2f}
-        Debt-to-Income Ratio: {debt_to_income:.1f}%
-        
-        Individual Debts:
-        {json.dumps(debts, indent=2)}
+        Annual Income: ${total_income:,.2f}
+        Debt-to-Income: {debt_to_income:.1f}%
+        Debts: {orjson.dumps(debt_rows).decode()}
         
         Provide:
-        1. Debt prioritization strategy (avalanche vs snowball)
-        2. Optimal payoff timeline with specific monthly payments
-        3. Potential interest savings with optimization
-        4. Consolidation opportunities
-        5. Credit score improvement strategies
-        6. Emergency fund considerations while paying debt
-        
-        Format as structured analysis with specific action items.
+        1. Prioritization strategy (avalanche vs snowball) with payoff timeline and monthly payments
+        2. Interest savings and consolidation opportunities
+        3. Credit score improvement strategies
+        
+        Use specific action items.
         """
         
         response = await self.generate_response(analysis_prompt, context)
         
         # Generate specific recommendations
-        recommendations = await self._generate_recommendations(debts, total_income)
+        recommendations = self._generate_recommendations(debts, total_income)
         
         return {
             "agent_type": "debt_analyzer",
@@ -78,7 +111,7 @@ Always provide specific, actionable recommendations with clear timelines and exp
             "priority_score": self._calculate_debt_priority(debt_to_income, total_debt)
         }
     
-    async def _generate_recommendations(self, debts: List[Dict], total_income: float) -> List[Dict[str, Any]]:
+    def _generate_recommendations(self, debts: List[Dict], total_income: float) -> List[Dict[str, Any]]:
         """Generate specific debt recommendations"""
         recommendations = []
         
@@ -100,25 +133,12 @@ Always provide specific, actionable recommendations with clear timelines and exp
         
         # Debt consolidation recommendation
         if len(debts) > 2:
-            recommendations.append({
-                "type": "consolidation",
-                "title": "Consider Debt Consolidation",
-                "description": "Multiple debts could benefit from consolidation",
-                "action": "Research personal loans or balance transfer cards with lower rates",
-                "impact": "Simplify payments and potentially reduce interest rates"
-            })
+            recommendations.append(_CONSOLIDATION_RECOMMENDATION.copy())
         
         return recommendations
     
     def _calculate_debt_priority(self, debt_to_income: float, total_debt: float) -> int:
         """Calculate priority score based on debt situation"""
-        if debt_to_income > 40:
-            return 10  # Critical
-        elif debt_to_income > 30:
-            return 8   # High
-        elif debt_to_income > 20:
-            return 6   # Medium
-        elif total_debt > 0:
-            return 4   # Low
-        else:
-            return 1   # Minimal
\ No newline at end of file
+        if total_debt <= 0:
+            return 1  # Minimal
+        return _DEBT_SCORES[bisect.bisect_left(_DEBT_THRESHOLDS, debt_to_income)]
@@ -1,10 +1,25 @@
 from typing import Dict, List, Any, Optional
+from .base_agent import BaseFinancialAgent, bucket_financial_data
 from .debt_analyzer import DebtAnalyzerAgent
 from .savings_strategy import SavingsStrategyAgent
 from .budget_optimizer import BudgetOptimizerAgent
 from database.supabase_client import SupabaseClient
+from cachetools import TTLCache
 import asyncio
 import json
+import os
+import re
+
+# Seconds a single agent analysis may take before the request fails
+AGENT_TIMEOUT = float(os.getenv("AGENT_TIMEOUT", "90"))
+
+# Routing keywords per agent; debt takes precedence over savings, then budget
+_ROUTE_RE = re.compile(
+    r"(?P<debt>debt|loan|credit|payoff|interest)"
+    r"|(?P<savings>save|saving|investment|retire|emergency fund)"
+    r"|(?P<budget>budget|expense|spending|cost|subscription)",
+    re.IGNORECASE
+)
 
 class AgentOrchestrator:
     def __init__(self, debt_agent: DebtAnalyzerAgent, savings_agent: SavingsStrategyAgent, 
@@ -13,29 +28,30 @@ class AgentOrchestrator:
         self.savings_agent = savings_agent
         self.budget_agent = budget_agent
         self.supabase_client = supabase_client
+        self._tier_agents = {
+            "debt": debt_agent,
+            "savings": savings_agent,
+            "budget": budget_agent
+        }
+        # Short-lived per-user cache of (financial_data, financial_summary)
+        self._user_cache = TTLCache(maxsize=1024, ttl=30)
     
     async def analyze_document(self, document_id: str) -> Dict[str, Any]:
         """Orchestrate analysis of a document by all agents"""
         try:
-            # Get document chunks and extract user_id
-            chunks = await self.supabase_client.get_document_chunks(document_id)
+            # Get document chunks and owning user_id (chunks don't carry user_id)
+            chunks, user_id = await asyncio.gather(
+                self.supabase_client.get_document_chunks(document_id),
+                self.supabase_client.get_document_user_id(document_id)
+            )
             if not chunks:
                 raise ValueError("No document chunks found")
             
-            # Get user_id from document
-            documents = await self.supabase_client.get_user_documents(chunks[0].get("user_id", ""))
-            user_id = None
-            for doc in documents:
-                if doc["id"] == document_id:
-                    user_id = doc["user_id"]
-                    break
-            
             if not user_id:
                 raise ValueError("Could not determine user_id for document")
             
-            # Get user's financial data
-            financial_data = await self.supabase_client.get_user_financial_data(user_id)
-            financial_summary = await self.supabase_client.get_financial_summary(user_id)
+            # Get user's financial data (a new document may have changed it)
+            financial_data, financial_summary = await self._get_user_financials(user_id, refresh=True)
             
             # Prepare context for agents
             context = {
@@ -45,11 +61,7 @@ class AgentOrchestrator:
             }
             
             # Run all agents in parallel
-            debt_analysis, savings_analysis, budget_analysis = await asyncio.gather(
-                self.debt_agent.analyze({"financial_data": financial_data}, context),
-                self.savings_agent.analyze({"financial_data": financial_data}, context),
-                self.budget_agent.analyze({"financial_data": financial_data}, context)
-            )
+            debt_analysis, savings_analysis, budget_analysis = await self._run_agents(financial_data, context)
             
             # Store insights in database
             await self._store_agent_insights(user_id, [debt_analysis, savings_analysis, budget_analysis])
@@ -72,61 +84,54 @@ class AgentOrchestrator:
     
     async def handle_user_query(self, user_id: str, message: str, session_id: str) -> str:
         """Handle user query by routing to appropriate agent(s)"""
+        context = await self._get_query_context(user_id)
+        agent = self._route_query(message, context)
+        return await agent.generate_response(message, context)
+    
+    async def _get_query_context(self, user_id: str) -> Dict[str, Any]:
+        """Build the agent context used to answer a user query"""
+        (financial_data, financial_summary), recent_insights = await asyncio.gather(
+            self._get_user_financials(user_id),
+            self.supabase_client.get_user_insights(user_id)
+        )
         
-        # Get user context
-        financial_data = await self.supabase_client.get_user_financial_data(user_id)
-        financial_summary = await self.supabase_client.get_financial_summary(user_id)
-        recent_insights = await self.supabase_client.get_user_insights(user_id)
-        
-        context = {
+        return {
             "financial_data": financial_data,
             "financial_summary": financial_summary,
-            "recent_insights": recent_insights
+            "recent_insights": recent_insights,
+            "tier": self._user_tier(financial_summary)
         }
-        
-        # Determine which agent(s) should handle the query
-        query_lower = message.lower()
-        
-        if any(keyword in query_lower for keyword in ["debt", "loan", "credit", "payoff", "interest"]):
-            response = await self.debt_agent.generate_response(message, context)
-        elif any(keyword in query_lower for keyword in ["save", "saving", "investment", "retire", "emergency fund"]):
-            response = await self.savings_agent.generate_response(message, context)
-        elif any(keyword in query_lower for keyword in ["budget", "expense", "spending", "cost", "subscription"]):
-            response = await self.budget_agent.generate_response(message, context)
+    
+    def _route_query(self, message: str, context: Dict[str, Any]) -> BaseFinancialAgent:
+        """Determine which agent should handle the query"""
+        routes = {match.lastgroup for match in _ROUTE_RE.finditer(message)}
+        
+        if "debt" in routes:
+            return self.debt_agent
+        elif "savings" in routes:
+            return self.savings_agent
+        elif "budget" in routes:
+            return self.budget_agent
         else:
             # General financial query - use the most relevant agent based on user's situation
-            response = await self._handle_general_query(message, context)
-        
-        return response
+            return self._select_general_agent(context)
     
     async def refresh_user_analysis(self, user_id: str) -> Dict[str, Any]:
         """Refresh all agent analysis for a user"""
         
         # Get user's financial data
-        financial_data = await self.supabase_client.get_user_financial_data(user_id)
-        financial_summary = await self.supabase_client.get_financial_summary(user_id)
+        financial_data, financial_summary = await self._get_user_financials(user_id, refresh=True)
         
         context = {
             "financial_summary": financial_summary,
             "user_id": user_id
         }
         
-        # Deactivate old insights
-        await asyncio.gather(
-            self.supabase_client.deactivate_old_insights(user_id, "debt_analyzer"),
-            self.supabase_client.deactivate_old_insights(user_id, "savings_strategy"),
-            self.supabase_client.deactivate_old_insights(user_id, "budget_optimizer")
-        )
-        
         # Run fresh analysis
-        debt_analysis, savings_analysis, budget_analysis = await asyncio.gather(
-            self.debt_agent.analyze({"financial_data": financial_data}, context),
-            self.savings_agent.analyze({"financial_data": financial_data}, context),
-            self.budget_agent.analyze({"financial_data": financial_data}, context)
-        )
+        debt_analysis, savings_analysis, budget_analysis = await self._run_agents(financial_data, context)
         
-        # Store new insights
-        await self._store_agent_insights(user_id, [debt_analysis, savings_analysis, budget_analysis])
+        # Replace old insights with the new ones
+        await self._store_agent_insights(user_id, [debt_analysis, savings_analysis, budget_analysis], replace=True)
         
         return {
             "debt_insights": len(debt_analysis.get("recommendations", [])),
@@ -134,70 +139,114 @@ class AgentOrchestrator:
             "budget_insights": len(budget_analysis.get("recommendations", []))
         }
     
-    async def _store_agent_insights(self, user_id: str, analyses: List[Dict[str, Any]]):
-        """Store agent insights in the database"""
+    async def _run_agents(self, financial_data: List[Dict[str, Any]], context: Dict[str, Any]):
+        """Run the debt, savings and budget analyses concurrently, each bounded by AGENT_TIMEOUT"""
         
+        # Split the rows by type once for all agents
+        agent_input = {"financial_data": financial_data, "buckets": bucket_financial_data(financial_data)}
+        
+        tasks = [
+            asyncio.create_task(self._run_agent(agent, agent_input, context))
+            for agent in (self.debt_agent, self.savings_agent, self.budget_agent)
+        ]
+        try:
+            return await asyncio.gather(*tasks)
+        except Exception:
+            # One failed analysis fails the request - stop the others instead of paying for them
+            for task in tasks:
+                task.cancel()
+            raise
+    
+    async def _run_agent(self, agent: BaseFinancialAgent, agent_input: Dict[str, Any], context: Dict[str, Any]):
+        """Run one agent analysis, naming the agent if it exceeds AGENT_TIMEOUT"""
+        try:
+            return await asyncio.wait_for(agent.analyze(agent_input, context), AGENT_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{agent.agent_name} analysis exceeded AGENT_TIMEOUT ({AGENT_TIMEOUT:g}s)") from None
+    
+    async def _get_user_financials(self, user_id: str, refresh: bool = False):
+        """Get a user's financial data and summary, served from the cache unless refresh is set"""
+        cached = None if refresh else self._user_cache.get(user_id)
+        if cached is None:
+            cached = await self.supabase_client.get_user_financial_bundle(user_id)
+            self._user_cache[user_id] = cached
+        return cached
+    
+    async def _store_agent_insights(self, user_id: str, analyses: List[Dict[str, Any]], replace: bool = False):
+        """Store agent insights in the database, optionally deactivating the agents' old insights"""
+        
+        rows = []
         for analysis in analyses:
             agent_type = analysis.get("agent_type")
             
-            # Store main analysis
-            await self.supabase_client.store_agent_insight(
-                user_id=user_id,
-                agent_type=agent_type,
-                insight_type="analysis",
-                title=f"{agent_type.replace('_', ' ').title()} Analysis",
-                content=analysis.get("analysis", ""),
-                recommendations=analysis.get("recommendations", []),
-                priority_score=analysis.get("priority_score", 5)
-            )
+            # Main analysis
+            rows.append({
+                "user_id": user_id,
+                "agent_type": agent_type,
+                "insight_type": "analysis",
+                "title": f"{agent_type.replace('_', ' ').title()} Analysis",
+                "content": analysis.get("analysis", ""),
+                "recommendations": analysis.get("recommendations", []),
+                "priority_score": analysis.get("priority_score", 5)
+            })
             
-            # Store individual recommendations
+            # Individual recommendations
             for rec in analysis.get("recommendations", []):
-                await self.supabase_client.store_agent_insight(
-                    user_id=user_id,
-                    agent_type=agent_type,
-                    insight_type="recommendation",
-                    title=rec.get("title", ""),
-                    content=rec.get("description", ""),
-                    recommendations=[rec],
-                    priority_score=8 if rec.get("type") in ["emergency_fund", "debt_prioritization"] else 5
-                )
+                rows.append({
+                    "user_id": user_id,
+                    "agent_type": agent_type,
+                    "insight_type": "recommendation",
+                    "title": rec.get("title", ""),
+                    "content": rec.get("description", ""),
+                    "recommendations": [rec],
+                    "priority_score": 8 if rec.get("type") in ["emergency_fund", "debt_prioritization"] else 5
+                })
+        
+        # One round-trip for every analysis and recommendation
+        if replace:
+            agent_types = [analysis.get("agent_type") for analysis in analyses]
+            await self.supabase_client.replace_agent_insights(user_id, agent_types, rows)
+        else:
+            await self.supabase_client.store_agent_insights_bulk(rows)
     
     async def _generate_summary(self, debt_analysis: Dict, savings_analysis: Dict, budget_analysis: Dict) -> str:
-        """Generate a comprehensive summary of all agent analyses"""
-        
-        summary_parts = []
-        
-        # Debt summary
-        debt_metrics = debt_analysis.get("metrics", {})
-        if debt_metrics.get("total_debt", 0) > 0:
-            summary_parts.append(f"Debt Analysis: ${debt_metrics.get('total_debt', 0):,.0f} total debt with {debt_metrics.get('debt_to_income_ratio', 0):.1f}% debt-to-income ratio")
+        """Generate a comprehensive summary of all agent analyses, skipping empty sections"""
         
-        # Savings summary
-        savings_metrics = savings_analysis.get("metrics", {})
-        summary_parts.append(f"Savings Analysis: {savings_metrics.get('savings_rate', 0):.1f}% savings rate, ${savings_metrics.get('total_savings', 0):,.0f} current savings")
-        
-        # Budget summary
-        budget_metrics = budget_analysis.get("metrics", {})
-        summary_parts.append(f"Budget Analysis: {budget_metrics.get('expense_ratio', 0):.1f}% expense ratio, largest category: {budget_metrics.get('largest_expense_category', 'N/A')}")
+        def summary_parts():
+            # Debt summary
+            debt_metrics = debt_analysis.get("metrics", {})
+            if debt_metrics.get("total_debt", 0) > 0:
+                yield f"Debt Analysis: ${debt_metrics['total_debt']:,.0f} total debt with {debt_metrics.get('debt_to_income_ratio', 0):.1f}% debt-to-income ratio"
+            
+            # Savings summary
+            savings_metrics = savings_analysis.get("metrics", {})
+            if savings_metrics.get("total_savings", 0) or savings_metrics.get("savings_rate", 0):
+                yield f"Savings Analysis: {savings_metrics.get('savings_rate', 0):.1f}% savings rate, ${savings_metrics.get('total_savings', 0):,.0f} current savings"
+            
+            # Budget summary
+            budget_metrics = budget_analysis.get("metrics", {})
+            if budget_metrics.get("monthly_income") or budget_metrics.get("monthly_expenses"):
+                yield f"Budget Analysis: {budget_metrics.get('expense_ratio', 0):.1f}% expense ratio, largest category: {budget_metrics.get('largest_expense_category', 'N/A')}"
         
-        return " | ".join(summary_parts)
+        return " | ".join(summary_parts())
     
-    async def _handle_general_query(self, message: str, context: Dict[str, Any]) -> str:
-        """Handle general financial queries by selecting the most appropriate agent"""
-        
-        # Analyze user's financial situation to determine priority
-        financial_summary = context.get("financial_summary", {})
-        
-        total_debt = financial_summary.get("total_debt", 0)
-        savings_rate = context.get("savings_rate", 0)
+    def _select_general_agent(self, context: Dict[str, Any]) -> BaseFinancialAgent:
+        """Select the most appropriate agent for a general financial query"""
+        return self._tier_agents[context.get("tier", "budget")]
+    
+    def _user_tier(self, financial_summary: Dict[str, Any]) -> str:
+        """Classify the user's financial situation to pick the agent for general queries"""
+        financial_summary = financial_summary or {}
+        total_income = financial_summary.get("total_income") or 0
+        total_expenses = financial_summary.get("total_expenses") or 0
+        savings_rate = ((total_income - total_expenses) / total_income * 100) if total_income > 0 else 0
         
         # If high debt, prioritize debt agent
-        if total_debt > 10000:
-            return await self.debt_agent.generate_response(message, context)
+        if (financial_summary.get("total_debt") or 0) > 10000:
+            return "debt"
         # If low savings rate, prioritize savings agent
         elif savings_rate < 15:
-            return await self.savings_agent.generate_response(message, context)
+            return "savings"
         # Otherwise, use budget agent
         else:
-            return await self.budget_agent.generate_response(message, context)
\ No newline at end of file
+            return "budget"
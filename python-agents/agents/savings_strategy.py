@@ -1,13 +1,20 @@
 from typing import Dict, List, Any
 from .base_agent import BaseFinancialAgent
-import json
+from cachetools import TTLCache
+import bisect
+import hashlib
+import orjson
 
-class SavingsStrategyAgent(BaseFinancialAgent):
-    def __init__(self):
-        super().__init__("savings_strategy")
-    
-    def get_system_prompt(self) -> str:
-        return """You are a specialized Savings Strategy Agent for RupAI, an AI Financial Coach. Your expertise is in:
+def _dumps_pretty(obj: Any) -> str:
+    """Serialize obj as indented JSON for prompts"""
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2).decode()
+
+# Savings-rate tiers: <10 medium-high, <20 medium, >=20 low; a large emergency fund gap overrides
+_EMERGENCY_GAP_THRESHOLD = 10000
+_SAVINGS_RATE_THRESHOLDS = (10, 20)
+_SAVINGS_RATE_SCORES = (7, 5, 3)
+
+_SYSTEM_PROMPT = """You are a specialized Savings Strategy Agent for RupAI, an AI Financial Coach. Your expertise is in:
 
 1. Savings Goal Planning & Optimization
 2. Investment Strategy Development
@@ -26,18 +33,77 @@ Your role is to:
 - Create automated savings plans
 
 Always provide specific, actionable recommendations with clear timelines, expected returns, and step-by-step implementation plans. Use actual numbers from the user's financial data to make calculations precise and personalized."""
+
+_PROMPT_TEMPLATE = """Analyze this savings situation and provide comprehensive recommendations:
+
+Current Savings: ${total_savings:,.2f}
+Monthly Income: ${monthly_income:,.2f}
+Monthly Expenses: ${monthly_expenses:,.2f}
+Monthly Surplus: ${monthly_surplus:,.2f}
+Current Savings Rate: {savings_rate:.1f}%
+
+Emergency Fund Target: ${emergency_fund_target:,.2f}
+Emergency Fund Gap: ${emergency_fund_gap:,.2f}
+
+Savings Breakdown:
+{savings_breakdown}
+
+Provide:
+1. Emergency fund completion strategy
+2. Optimal savings rate recommendations (target 20%)
+3. High-yield savings account recommendations
+4. Investment allocation strategy based on age/goals
+5. Retirement savings optimization (401k, IRA)
+6. Automated savings plan setup
+7. Tax-advantaged account prioritization
+
+Format as structured analysis with specific action items and timelines."""
+
+# Static fields of the high-yield savings recommendation; only "impact" varies
+_HIGH_YIELD_TEMPLATE = {
+    "type": "account_optimization",
+    "title": "Optimize Savings Accounts",
+    "description": "Move savings to high-yield accounts",
+    "action": "Research accounts offering 4-5% APY vs traditional 0.1%"
+}
+
+_INVESTMENT_RECOMMENDATION = {
+    "type": "investment",
+    "title": "Start Investment Portfolio",
+    "description": "Begin investing surplus savings for long-term growth",
+    "action": "Open investment account and start with 60/40 stock/bond allocation",
+    "impact": "Potential 7-10% annual returns vs 2-3% in savings"
+}
+
+def _savings_numerics(total_savings: float, monthly_surplus: float, emergency_fund_gap: float):
+    """Numbers behind the savings recommendations: (months_to_complete, monthly_emergency_saving, target_increase, interest_gain)"""
+    months_to_complete = emergency_fund_gap / max(monthly_surplus * 0.5, 100.0)
+    monthly_emergency_saving = min(monthly_surplus * 0.5, emergency_fund_gap / 6.0)
+    target_increase = max(100.0, monthly_surplus * 0.2)
+    interest_gain = total_savings * 0.04
+    return months_to_complete, monthly_emergency_saving, target_increase, interest_gain
+
+class SavingsStrategyAgent(BaseFinancialAgent):
+    def __init__(self):
+        super().__init__("savings_strategy")
+        self._response_cache = TTLCache(maxsize=1024, ttl=3600)
+    
+    def get_system_prompt(self) -> str:
+        return _SYSTEM_PROMPT
     
     async def analyze(self, financial_data: Dict[str, Any], context: Dict[str, Any]) -> Dict[str, Any]:
         """Analyze savings situation and provide recommendations"""
         
         # Extract financial information
-        savings_data = [item for item in financial_data.get("financial_data", []) if item.get("data_type") == "savings"]
-        income_data = [item for item in financial_data.get("financial_data", []) if item.get("data_type") == "income"]
-        expense_data = [item for item in financial_data.get("financial_data", []) if item.get("data_type") == "expense"]
+        buckets = self._get_buckets(financial_data)
+        savings_data = buckets["rows"].get("savings", [])
         
-        total_savings = sum(saving.get("amount", 0) for saving in savings_data)
-        total_income = sum(income.get("amount", 0) for income in income_data)
-        total_expenses = sum(expense.get("amount", 0) for expense in expense_data)
+        # Prefer the totals already aggregated in Postgres by get_user_financial_summary
+        summary = context.get("financial_summary") or {}
+        totals = buckets["totals"]
+        total_savings = summary.get("total_savings", totals.get("savings", 0.0))
+        total_income = summary.get("total_income", totals.get("income", 0.0))
+        total_expenses = summary.get("total_expenses", totals.get("expense", 0.0))
         
         monthly_income = total_income / 12
         monthly_expenses = total_expenses / 12
@@ -49,37 +115,30 @@ Always provide specific, actionable recommendations with clear timelines, expect
         emergency_fund_gap = max(0, emergency_fund_target - total_savings)
         
         # Prepare analysis prompt
-        analysis_prompt = f"""
-        Analyze this savings situation and provide comprehensive recommendations:
-        
-        Current Savings: ${total_savings:,.2f}
-        Monthly Income: ${monthly_income:,.2f}
-        Monthly Expenses: ${monthly_expenses:,.2f}
-        Monthly Surplus: ${monthly_surplus:,.2f}
-        Current Savings Rate: {savings_rate:.1f}%
-        
-        Emergency Fund Target: ${emergency_fund_target:,.2f}
-        Emergency Fund Gap: ${emergency_fund_gap:,.2f}
-        
-        Savings Breakdown:
-        {json.dumps(savings_data, indent=2)}
-        
-        Provide:
-        1. Emergency fund completion strategy
-        2. Optimal savings rate recommendations (target 20%)
-        3. High-yield savings account recommendations
-        4. Investment allocation strategy based on age/goals
-        5. Retirement savings optimization (401k, IRA)
-        6. Automated savings plan setup
-        7. Tax-advantaged account prioritization
-        
-        Format as structured analysis with specific action items and timelines.
-        """
+        analysis_prompt = _PROMPT_TEMPLATE.format_map({
+            "total_savings": total_savings,
+            "monthly_income": monthly_income,
+            "monthly_expenses": monthly_expenses,
+            "monthly_surplus": monthly_surplus,
+            "savings_rate": savings_rate,
+            "emergency_fund_target": emergency_fund_target,
+            "emergency_fund_gap": emergency_fund_gap,
+            "savings_breakdown": _dumps_pretty(savings_data)
+        })
         
-        response = await self.generate_response(analysis_prompt, context)
+        # Identical snapshots (same prompt and context) reuse the earlier LLM analysis.
+        # The context is formatted once and shared by the cache key and the LLM call
+        formatted_context = self._format_context(context)
+        cache_key = hashlib.blake2b(
+            f"{analysis_prompt}\0{formatted_context}".encode(), digest_size=16
+        ).digest()
+        response = self._response_cache.get(cache_key)
+        if response is None:
+            response = await self.generate_response(analysis_prompt, context, formatted_context)
+            self._response_cache[cache_key] = response
         
         # Generate specific recommendations
-        recommendations = await self._generate_recommendations(
+        recommendations = self._generate_recommendations(
             total_savings, monthly_surplus, emergency_fund_gap, savings_rate
         )
         
@@ -96,25 +155,26 @@ Always provide specific, actionable recommendations with clear timelines, expect
             "priority_score": self._calculate_savings_priority(savings_rate, emergency_fund_gap)
         }
     
-    async def _generate_recommendations(self, total_savings: float, monthly_surplus: float, 
-                                      emergency_fund_gap: float, savings_rate: float) -> List[Dict[str, Any]]:
+    def _generate_recommendations(self, total_savings: float, monthly_surplus: float, 
+                                  emergency_fund_gap: float, savings_rate: float) -> List[Dict[str, Any]]:
         """Generate specific savings recommendations"""
         recommendations = []
+        months_to_complete, monthly_emergency_saving, target_increase, interest_gain = _savings_numerics(
+            total_savings, monthly_surplus, emergency_fund_gap
+        )
         
         # Emergency fund recommendation
         if emergency_fund_gap > 0:
-            months_to_complete = emergency_fund_gap / max(monthly_surplus * 0.5, 100)
             recommendations.append({
                 "type": "emergency_fund",
                 "title": "Complete Emergency Fund",
                 "description": f"Build emergency fund to ${emergency_fund_gap + total_savings:,.0f}",
-                "action": f"Save ${min(monthly_surplus * 0.5, emergency_fund_gap / 6):,.0f}/month in high-yield savings",
+                "action": f"Save ${monthly_emergency_saving:,.0f}/month in high-yield savings",
                 "impact": f"Complete in {months_to_complete:.0f} months, providing 6 months expense coverage"
             })
         
         # Savings rate optimization
         if savings_rate < 20:
-            target_increase = max(100, monthly_surplus * 0.2)
             recommendations.append({
                 "type": "savings_rate",
                 "title": "Increase Savings Rate",
@@ -125,32 +185,17 @@ Always provide specific, actionable recommendations with clear timelines, expect
         
         # Investment recommendation
         if total_savings > 10000:  # Has emergency fund
-            recommendations.append({
-                "type": "investment",
-                "title": "Start Investment Portfolio",
-                "description": "Begin investing surplus savings for long-term growth",
-                "action": "Open investment account and start with 60/40 stock/bond allocation",
-                "impact": "Potential 7-10% annual returns vs 2-3% in savings"
-            })
+            recommendations.append(_INVESTMENT_RECOMMENDATION.copy())
         
         # High-yield savings
-        recommendations.append({
-            "type": "account_optimization",
-            "title": "Optimize Savings Accounts",
-            "description": "Move savings to high-yield accounts",
-            "action": "Research accounts offering 4-5% APY vs traditional 0.1%",
-            "impact": f"Earn additional ${total_savings * 0.04:.0f}/year in interest"
-        })
+        high_yield = _HIGH_YIELD_TEMPLATE.copy()
+        high_yield["impact"] = f"Earn additional ${interest_gain:.0f}/year in interest"
+        recommendations.append(high_yield)
         
         return recommendations
     
     def _calculate_savings_priority(self, savings_rate: float, emergency_fund_gap: float) -> int:
         """Calculate priority score based on savings situation"""
-        if emergency_fund_gap > 10000:
+        if emergency_fund_gap > _EMERGENCY_GAP_THRESHOLD:
             return 9  # High priority - no emergency fund
-        elif savings_rate < 10:
-            return 7  # Medium-high priority - low savings rate
-        elif savings_rate < 20:
-            return 5  # Medium priority - below recommended rate
-        else:
-            return 3  # Low priority - good savings habits
\ No newline at end of file
+        return _SAVINGS_RATE_SCORES[bisect.bisect_right(_SAVINGS_RATE_THRESHOLDS, savings_rate)]
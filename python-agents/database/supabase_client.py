@@ -1,29 +1,79 @@
 import os
-from supabase import create_client, Client
-from typing import List, Dict, Any, Optional
+from postgrest import AsyncPostgrestClient, DEFAULT_POSTGREST_CLIENT_HEADERS
+from typing import List, Dict, Any, Optional, Tuple
+import asyncio
+import httpx
 import json
 
+# Connection pool shared by every PostgREST request
+_HTTP_LIMITS = httpx.Limits(
+    max_connections=int(os.getenv("SUPABASE_MAX_CONNECTIONS", "100")),
+    max_keepalive_connections=int(os.getenv("SUPABASE_MAX_KEEPALIVE", "50")),
+    keepalive_expiry=float(os.getenv("SUPABASE_KEEPALIVE_EXPIRY", "60"))
+)
+_HTTP_TIMEOUT = 10.0
+
+class _PooledPostgrestClient(AsyncPostgrestClient):
+    """PostgREST client whose requests are multiplexed over pooled HTTP/2 connections"""
+    
+    def create_session(self, base_url: str, headers: Dict[str, str], timeout) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            http2=True,
+            limits=_HTTP_LIMITS
+        )
+
 class SupabaseClient:
     def __init__(self):
         self.url = os.getenv("SUPABASE_URL")
         self.key = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
-        self.client: Client = create_client(self.url, self.key)
+        self.client = _PooledPostgrestClient(
+            f"{self.url}/rest/v1",
+            headers={
+                **DEFAULT_POSTGREST_CLIENT_HEADERS,
+                "apiKey": self.key,
+                "Authorization": f"Bearer {self.key}"
+            },
+            timeout=_HTTP_TIMEOUT
+        )
     
+    async def aclose(self):
+        """Close the pooled HTTP connections"""
+        await self.client.aclose()
+
+    async def warmup(self):
+        """Open a pooled connection ahead of the first request"""
+        try:
+            await self.client.session.head("/")
+        except httpx.HTTPError:
+            # Best effort - the first real query will connect instead
+            pass
+
     async def get_document_chunks(self, document_id: str) -> List[Dict[str, Any]]:
         """Get all chunks for a document"""
-        response = self.client.table("document_chunks").select("*").eq("document_id", document_id).execute()
+        response = await self.client.table("document_chunks").select("*").eq("document_id", document_id).execute()
         return response.data
     
     async def get_user_financial_data(self, user_id: str) -> List[Dict[str, Any]]:
         """Get all financial data for a user"""
-        response = self.client.table("financial_data").select("*").eq("user_id", user_id).execute()
+        response = await self.client.table("financial_data").select("*").eq("user_id", user_id).execute()
         return response.data
     
     async def get_financial_summary(self, user_id: str) -> Dict[str, Any]:
         """Get financial summary using the database function"""
-        response = self.client.rpc("get_user_financial_summary", {"user_id": user_id}).execute()
+        response = await self.client.rpc("get_user_financial_summary", {"user_id": user_id}).execute()
         return response.data if response.data else {}
     
+    async def get_user_financial_bundle(self, user_id: str) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Get a user's financial data and financial summary concurrently"""
+        financial_data, financial_summary = await asyncio.gather(
+            self.get_user_financial_data(user_id),
+            self.get_financial_summary(user_id)
+        )
+        return financial_data, financial_summary
+    
     async def store_agent_insight(self, user_id: str, agent_type: str, insight_type: str, 
                                 title: str, content: str, recommendations: List[Dict], 
                                 priority_score: int = 5) -> str:
@@ -37,25 +87,42 @@ class SupabaseClient:
             "recommendations": recommendations,
             "priority_score": priority_score
         }
-        response = self.client.table("agent_insights").insert(data).execute()
+        response = await self.client.table("agent_insights").insert(data).execute()
         return response.data[0]["id"] if response.data else None
     
+    async def store_agent_insights_bulk(self, rows: List[Dict[str, Any]]) -> List[str]:
+        """Store several agent insights in a single insert"""
+        if not rows:
+            return []
+        response = await self.client.table("agent_insights").insert(rows).execute()
+        return [row["id"] for row in response.data] if response.data else []
+    
+    async def replace_agent_insights(self, user_id: str, agent_types: List[str],
+                                     rows: List[Dict[str, Any]]) -> List[str]:
+        """Deactivate a user's insights for agent_types and store rows, atomically in one RPC"""
+        response = await self.client.rpc("replace_agent_insights", {
+            "user_id": user_id,
+            "agent_types": agent_types,
+            "insights": rows
+        }).execute()
+        return response.data if response.data else []
+    
     async def get_user_insights(self, user_id: str, agent_type: Optional[str] = None) -> List[Dict[str, Any]]:
         """Get insights for a user, optionally filtered by agent type"""
         query = self.client.table("agent_insights").select("*").eq("user_id", user_id).eq("is_active", True)
         if agent_type:
             query = query.eq("agent_type", agent_type)
-        response = query.order("created_at", desc=True).execute()
+        response = await query.order("created_at", desc=True).execute()
         return response.data
     
     async def deactivate_old_insights(self, user_id: str, agent_type: str):
         """Deactivate old insights for a specific agent type"""
-        self.client.table("agent_insights").update({"is_active": False}).eq("user_id", user_id).eq("agent_type", agent_type).execute()
+        await self.client.table("agent_insights").update({"is_active": False}).eq("user_id", user_id).eq("agent_type", agent_type).execute()
     
     async def search_similar_chunks(self, user_id: str, query_embedding: List[float], 
                                   threshold: float = 0.7, limit: int = 5) -> List[Dict[str, Any]]:
         """Search for similar document chunks using vector similarity"""
-        response = self.client.rpc("match_document_chunks", {
+        response = await self.client.rpc("match_document_chunks", {
             "query_embedding": query_embedding,
             "match_threshold": threshold,
             "match_count": limit,
@@ -65,12 +132,17 @@ class SupabaseClient:
     
     async def get_user_documents(self, user_id: str) -> List[Dict[str, Any]]:
         """Get all documents for a user"""
-        response = self.client.table("financial_documents").select("*").eq("user_id", user_id).execute()
+        response = await self.client.table("financial_documents").select("*").eq("user_id", user_id).execute()
         return response.data
     
+    async def get_document_user_id(self, document_id: str) -> Optional[str]:
+        """Get the owning user_id of a document"""
+        response = await self.client.table("financial_documents").select("user_id").eq("id", document_id).limit(1).execute()
+        return response.data[0]["user_id"] if response.data else None
+    
     async def update_document_status(self, document_id: str, status: str, metadata: Dict = None):
         """Update document processing status"""
         update_data = {"upload_status": status}
         if metadata:
             update_data["processing_metadata"] = metadata
-        self.client.table("financial_documents").update(update_data).eq("id", document_id).execute()
\ No newline at end of file
+        await self.client.table("financial_documents").update(update_data).eq("id", document_id).execute()
\ No newline at end of file
@@ -1,17 +1,43 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
+from contextlib import asynccontextmanager
 import os
 from dotenv import load_dotenv
+
+# Load .env before the agent modules read their settings at import
+load_dotenv()
+
 from agents.debt_analyzer import DebtAnalyzerAgent
 from agents.savings_strategy import SavingsStrategyAgent
 from agents.budget_optimizer import BudgetOptimizerAgent
 from agents.orchestrator import AgentOrchestrator
 from database.supabase_client import SupabaseClient
 
-load_dotenv()
+# Clients and agents, created at startup by lifespan()
+supabase_client: SupabaseClient = None
+orchestrator: AgentOrchestrator = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Create clients and agents inside the event loop and warm connections before serving"""
+    global supabase_client, orchestrator
+    supabase_client = SupabaseClient()
+    orchestrator = AgentOrchestrator(
+        DebtAnalyzerAgent(), SavingsStrategyAgent(), BudgetOptimizerAgent(), supabase_client
+    )
+    await supabase_client.warmup()
+    yield
+    await supabase_client.aclose()
 
-app = FastAPI(title="RupAI Financial Agents", version="1.0.0")
+app = FastAPI(
+    title="RupAI Financial Agents",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -21,12 +47,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize clients and agents
-supabase_client = SupabaseClient()
-debt_agent = DebtAnalyzerAgent()
-savings_agent = SavingsStrategyAgent()
-budget_agent = BudgetOptimizerAgent()
-orchestrator = AgentOrchestrator(debt_agent, savings_agent, budget_agent, supabase_client)
+# Compress larger JSON payloads such as insight lists
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
 class DocumentAnalysisRequest(BaseModel):
     document_id: str
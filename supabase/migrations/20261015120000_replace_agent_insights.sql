@@ -0,0 +1,50 @@
+/*
+  # Atomic Agent Insight Refresh
+
+  1. Functions
+    - `replace_agent_insights` - Deactivate a user's active insights for the given
+      agent types and insert the new ones in a single transaction
+
+  2. Security
+    - Runs with caller rights, so agent_insights RLS policies still apply
+*/
+
+CREATE OR REPLACE FUNCTION replace_agent_insights(
+  user_id uuid,
+  agent_types text[],
+  insights jsonb
+)
+RETURNS SETOF uuid
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  UPDATE agent_insights
+  SET is_active = false
+  WHERE agent_insights.user_id = replace_agent_insights.user_id
+    AND agent_insights.agent_type = ANY(replace_agent_insights.agent_types)
+    AND agent_insights.is_active;
+
+  RETURN QUERY
+  INSERT INTO agent_insights (user_id, agent_type, insight_type, title, content, recommendations, priority_score)
+  SELECT
+    replace_agent_insights.user_id,
+    i.agent_type,
+    i.insight_type,
+    i.title,
+    i.content,
+    COALESCE(i.recommendations, '[]'::jsonb),
+    COALESCE(i.priority_score, 5)
+  FROM jsonb_to_recordset(insights) AS i(
+    agent_type text,
+    insight_type text,
+    title text,
+    content text,
+    recommendations jsonb,
+    priority_score integer
+  )
+  RETURNING agent_insights.id;
+END;
+$$;
+
+-- Grant execute permissions
+GRANT EXECUTE ON FUNCTION replace_agent_insights TO authenticated;